@@ -19,10 +19,13 @@ The `postgresql` module provides methods for interacting with the PostgreSQL ins
 Any charm using this library should import the `psycopg2` or `psycopg2-binary` dependency.
 """
 import logging
-from typing import List, Set
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, Iterator, Set, Tuple
 
 import psycopg2
 from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
 
 # The unique Charmhub library identifier, never change it
 LIBID = "24ee217a54e840a598ff21a079c3e678"
@@ -32,11 +35,21 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 2
+LIBPATCH = 3
 
 
 logger = logging.getLogger(__name__)
 
+# Number of seconds after which an unused connection pool is closed.
+POOL_IDLE_TIMEOUT = 60
+
+# Connection pools (and the last time they were used) shared by all the
+# PostgreSQL objects, indexed by the connection string.
+_pools: Dict[str, Tuple[ThreadedConnectionPool, float]] = {}
+
+# PostgreSQL versions shared by all the PostgreSQL objects, indexed by the host.
+_postgresql_versions: Dict[str, str] = {}
+
 
 class PostgreSQLCreateDatabaseError(Exception):
     """Exception raised when creating a database fails."""
@@ -77,21 +90,81 @@ class PostgreSQL:
         self.password = password
         self.database = database
 
-    def _connect_to_database(self, database: str = None) -> psycopg2.extensions.connection:
-        """Creates a connection to the database.
+    def _get_connection_pool(self, database: str) -> ThreadedConnectionPool:
+        """Returns the connection pool for a database, creating it if needed.
+
+        Args:
+            database: database whose connections are managed by the pool.
+
+        Returns:
+             psycopg2 connection pool object.
+        """
+        connection_string = f"dbname='{database}' user='{self.user}' host='{self.host}' password='{self.password}' connect_timeout=1"
+        now = monotonic()
+        # Close the pools that weren't used recently.
+        for key, (pool, last_used) in list(_pools.items()):
+            if key != connection_string and now - last_used > POOL_IDLE_TIMEOUT:
+                pool.closeall()
+                del _pools[key]
+        if connection_string in _pools:
+            pool = _pools[connection_string][0]
+        else:
+            pool = ThreadedConnectionPool(minconn=1, maxconn=8, dsn=connection_string)
+        _pools[connection_string] = (pool, now)
+        return pool
+
+    @contextmanager
+    def _connect_to_database(
+        self, database: str = None
+    ) -> Iterator[psycopg2.extensions.connection]:
+        """Gets a connection to the database from a pool.
+
+        The connection is returned to the pool when the context is exited.
 
         Args:
             database: database to connect to (defaults to the database
                 provided when the object for this class was created).
 
-        Returns:
+        Yields:
              psycopg2 connection object.
         """
-        connection = psycopg2.connect(
-            f"dbname='{database if database else self.database}' user='{self.user}' host='{self.host}' password='{self.password}' connect_timeout=1"
-        )
+        pool = self._get_connection_pool(database if database else self.database)
+        connection = pool.getconn()
+        # Discard the connections that were closed or terminated by the server
+        # (like after a Patroni restart or a failover) while they were in the pool
+        # (at most all of them, after which the pool opens a new connection).
+        for _ in range(pool.maxconn):
+            if self._is_connection_alive(connection):
+                break
+            pool.putconn(connection, close=True)
+            connection = pool.getconn()
         connection.autocommit = True
-        return connection
+        try:
+            yield connection
+        finally:
+            pool.putconn(connection, close=bool(connection.closed))
+
+    @staticmethod
+    def _is_connection_alive(connection: psycopg2.extensions.connection) -> bool:
+        """Checks whether a connection can still be used.
+
+        Args:
+            connection: psycopg2 connection object.
+
+        Returns:
+            whether the connection is still alive.
+        """
+        if connection.closed:
+            return False
+        try:
+            # A connection terminated by the server is only detected when it's used
+            # (in autocommit mode, so the check doesn't leave a transaction open).
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+        except psycopg2.Error:
+            return False
+        return True
 
     def create_database(self, database: str, user: str) -> None:
         """Creates a new database and grant privileges to a user on it.
@@ -101,16 +174,15 @@ class PostgreSQL:
             user: user that will have access to the database.
         """
         try:
-            connection = self._connect_to_database()
-            cursor = connection.cursor()
-            cursor.execute(f"SELECT datname FROM pg_database WHERE datname='{database}';")
-            if cursor.fetchone() is None:
-                cursor.execute(sql.SQL("CREATE DATABASE {};").format(sql.Identifier(database)))
-            cursor.execute(
-                sql.SQL("GRANT ALL PRIVILEGES ON DATABASE {} TO {};").format(
-                    sql.Identifier(database), sql.Identifier(user)
+            with self._connect_to_database() as connection, connection.cursor() as cursor:
+                cursor.execute("SELECT datname FROM pg_database WHERE datname = %s;", (database,))
+                if cursor.fetchone() is None:
+                    cursor.execute(sql.SQL("CREATE DATABASE {};").format(sql.Identifier(database)))
+                cursor.execute(
+                    sql.SQL("GRANT ALL PRIVILEGES ON DATABASE {} TO {};").format(
+                        sql.Identifier(database), sql.Identifier(user)
+                    )
                 )
-            )
         except psycopg2.Error as e:
             logger.error(f"Failed to create database: {e}")
             raise PostgreSQLCreateDatabaseError()
@@ -124,19 +196,44 @@ class PostgreSQL:
             user: user to be created.
             password: password to be assigned to the user.
             admin: whether the user should have additional admin privileges.
-            extra_user_roles: additional roles to be assigned to the user.
+            extra_user_roles: additional roles to be assigned to the user
+                (role options, like CREATEDB, separated by commas or spaces).
+
+        Raises:
+            PostgreSQLCreateUserError if the user couldn't be created
+                or the extra user roles aren't plain role options.
         """
+        user_definition = "WITH LOGIN{} ENCRYPTED PASSWORD %s".format(
+            " SUPERUSER" if admin else ""
+        )
+        if extra_user_roles:
+            # Role options are keywords (like CREATEDB), so they can't be
+            # passed as parameters; only allow plain words to be added
+            # (ignoring empty entries, like the one after a trailing comma).
+            roles = extra_user_roles.replace(",", " ").split()
+            if not all(role.isalpha() for role in roles):
+                logger.error(f"Invalid extra user roles: {extra_user_roles}")
+                raise PostgreSQLCreateUserError()
+            user_definition += "".join(f" {role.upper()}" for role in roles)
+
         try:
             with self._connect_to_database() as connection, connection.cursor() as cursor:
-                cursor.execute(f"SELECT TRUE FROM pg_roles WHERE rolname='{user}';")
-                user_definition = f" WITH LOGIN{' SUPERUSER' if admin else ''} ENCRYPTED PASSWORD '{password}'"
-                if extra_user_roles:
-                    user_definition += f' {extra_user_roles.replace(",", " ")}'
-                if cursor.fetchone() is not None:
-                    statement = "ALTER ROLE {}"
-                else:
-                    statement = "CREATE ROLE {}"
-                cursor.execute(sql.SQL(statement + user_definition + ";").format(sql.Identifier(user)))
+                # Try to create the user and update it if it already exists,
+                # which avoids a round trip to check whether it exists first.
+                try:
+                    cursor.execute(
+                        sql.SQL("CREATE ROLE {} " + user_definition + ";").format(
+                            sql.Identifier(user)
+                        ),
+                        (password,),
+                    )
+                except psycopg2.errors.DuplicateObject:
+                    cursor.execute(
+                        sql.SQL("ALTER ROLE {} " + user_definition + ";").format(
+                            sql.Identifier(user)
+                        ),
+                        (password,),
+                    )
         except psycopg2.Error as e:
             logger.error(f"Failed to create user: {e}")
             raise PostgreSQLCreateUserError()
@@ -147,26 +244,42 @@ class PostgreSQL:
         Args:
             user: user to be deleted.
         """
-        # List all databases.
         try:
+            # List the databases where the user owns objects or has privileges
+            # (the ones on shared objects, like databases, are listed as the
+            # current database, as they can be dropped from any database).
             with self._connect_to_database() as connection, connection.cursor() as cursor:
-                cursor.execute("SELECT datname FROM pg_database WHERE datistemplate = false;")
+                cursor.execute(
+                    "SELECT DISTINCT COALESCE(datname, current_database()) FROM pg_shdepend"
+                    " LEFT JOIN pg_database ON pg_database.oid = pg_shdepend.dbid"
+                    " WHERE refclassid = 'pg_authid'::regclass"
+                    " AND refobjid = (SELECT oid FROM pg_roles WHERE rolname = %s)"
+                    " AND datistemplate IS NOT TRUE;",
+                    (user,),
+                )
                 databases = [row[0] for row in cursor.fetchall()]
 
             # Existing objects need to be reassigned in each database
-            # before the user can be deleted.
+            # before the user can be deleted (both statements are sent
+            # in a single round trip).
+            reassign_and_drop_owned = sql.SQL(
+                "REASSIGN OWNED BY {user} TO {owner}; DROP OWNED BY {user};"
+            ).format(user=sql.Identifier(user), owner=sql.Identifier(self.user))
             for database in databases:
+                if database == self.database:
+                    continue
                 with self._connect_to_database(
                     database
                 ) as connection, connection.cursor() as cursor:
-                    cursor.execute(sql.SQL("REASSIGN OWNED BY {} TO {};").format(
-                        sql.Identifier(user), sql.Identifier(self.user)
-                    ))
-                    cursor.execute(sql.SQL("DROP OWNED BY {};").format(sql.Identifier(user)))
+                    cursor.execute(reassign_and_drop_owned)
 
-            # Delete the user.
+            # Delete the user, batching the cleanup of the default database
+            # in the same round trip when it's needed.
+            statements = [sql.SQL("DROP ROLE {};").format(sql.Identifier(user))]
+            if self.database in databases:
+                statements.insert(0, reassign_and_drop_owned)
             with self._connect_to_database() as connection, connection.cursor() as cursor:
-                cursor.execute(sql.SQL("DROP ROLE {};").format(sql.Identifier(user)))
+                cursor.execute(sql.SQL(" ").join(statements))
         except psycopg2.Error as e:
             logger.error(f"Failed to delete user: {e}")
             raise PostgreSQLDeleteUserError()
@@ -177,11 +290,16 @@ class PostgreSQL:
         Returns:
             PostgreSQL version number.
         """
+        # The version doesn't change while the server is running, so query it only once
+        # (at module level, as the charm creates a new object every time it's used).
+        if self.host in _postgresql_versions:
+            return _postgresql_versions[self.host]
         try:
             with self._connect_to_database() as connection, connection.cursor() as cursor:
                 cursor.execute("SELECT version();")
                 # Split to get only the version number.
-                return cursor.fetchone()[0].split(" ")[1]
+                _postgresql_versions[self.host] = cursor.fetchone()[0].split(" ")[1]
+                return _postgresql_versions[self.host]
         except psycopg2.Error as e:
             logger.error(f"Failed to get PostgreSQL version: {e}")
             raise PostgreSQLGetPostgreSQLVersionError()
@@ -195,8 +313,8 @@ class PostgreSQL:
         try:
             with self._connect_to_database() as connection, connection.cursor() as cursor:
                 cursor.execute("SELECT usename FROM pg_catalog.pg_user;")
-                usernames = cursor.fetchall()
-                return {username[0] for username in usernames}
+                # Iterate over the cursor to not build an intermediate list of rows.
+                return {username for (username,) in cursor}
         except psycopg2.Error as e:
             logger.error(f"Failed to list PostgreSQL database users: {e}")
             raise PostgreSQLListUsersError()
@@ -214,13 +332,11 @@ class PostgreSQL:
         try:
             with self._connect_to_database() as connection, connection.cursor() as cursor:
                 cursor.execute(
-                    sql.SQL("ALTER USER {} WITH ENCRYPTED PASSWORD '" + password + "';").format(
+                    sql.SQL("ALTER USER {} WITH ENCRYPTED PASSWORD %s;").format(
                         sql.Identifier(username)
-                    )
+                    ),
+                    (password,),
                 )
         except psycopg2.Error as e:
             logger.error(f"Failed to update user password: {e}")
             raise PostgreSQLUpdateUserPasswordError()
-        finally:
-            if connection is not None:
-                connection.close()
@@ -6,8 +6,11 @@
 import logging
 import os
 import pwd
+import stat
 import subprocess
-from typing import Set
+import time
+from functools import lru_cache
+from typing import Dict, Set, Tuple
 
 import requests
 from charms.operator_libs_linux.v0.apt import DebianPackage
@@ -16,7 +19,8 @@ from charms.operator_libs_linux.v1.systemd import (
     service_running,
     service_start,
 )
-from jinja2 import Template
+from jinja2 import Environment, FileSystemLoader
+from requests.adapters import HTTPAdapter
 from tenacity import (
     RetryError,
     Retrying,
@@ -34,6 +38,25 @@ logger = logging.getLogger(__name__)
 
 PATRONI_SERVICE = "patroni"
 
+# Number of seconds to wait for the Patroni API to answer a request.
+API_REQUEST_TIMEOUT = 5
+
+# Environment used to load the templates, which keeps them compiled after the first use.
+TEMPLATE_ENVIRONMENT = Environment(loader=FileSystemLoader("templates"), auto_reload=False)
+
+# Cluster statuses retrieved from the Patroni API (and the time they were retrieved)
+# shared by all the Patroni objects, indexed by the IP of the unit that was queried.
+_cluster_statuses: Dict[str, Tuple[float, Dict]] = {}
+
+# Raft cluster statuses retrieved from syncobj (and the time they were retrieved)
+# shared by all the Patroni objects, indexed by the IP of the unit.
+_raft_statuses: Dict[str, Tuple[float, str]] = {}
+
+# Session used to keep the connections to the Patroni API alive between requests, shared
+# by all the Patroni objects (as the charm creates a new one every time it's used).
+_http_session = requests.Session()
+_http_session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=8))
+
 
 class NotReadyError(Exception):
     """Raised when not all cluster members healthy or finished initial sync."""
@@ -99,9 +122,10 @@ class Patroni:
         """
         self._change_owner(self.storage_path)
         self.render_patroni_yml_file(replica)
-        self._render_patroni_service_file()
-        # Reload systemd services before trying to start Patroni.
-        daemon_reload()
+        # Reload systemd services before trying to start Patroni
+        # (only needed when the service file has changed).
+        if self._render_patroni_service_file():
+            daemon_reload()
         self.render_postgresql_conf_file()
 
     def _change_owner(self, path: str) -> None:
@@ -110,18 +134,25 @@ class Patroni:
         Args:
             path: path to a file or directory.
         """
-        # Get the uid/gid for the postgres user.
-        user_database = pwd.getpwnam("postgres")
+        uid, gid = self._get_postgres_user_ids()
         # Set the correct ownership for the file or directory.
-        os.chown(path, uid=user_database.pw_uid, gid=user_database.pw_gid)
+        os.chown(path, uid=uid, gid=gid)
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _get_postgres_user_ids() -> Tuple[int, int]:
+        """Return the uid/gid for the postgres user.
+
+        The result is cached to avoid a user database lookup every time a path is chowned.
+        """
+        user_database = pwd.getpwnam("postgres")
+        return user_database.pw_uid, user_database.pw_gid
 
     @property
     @retry(stop=stop_after_attempt(10), wait=wait_exponential(multiplier=1, min=2, max=10))
     def cluster_members(self) -> set:
         """Get the current cluster members."""
-        # Request info from cluster endpoint (which returns all members of the cluster).
-        cluster_status = requests.get(f"http://{self.unit_ip}:8008/cluster")
-        return set([member["name"] for member in cluster_status.json()["members"]])
+        return set([member["name"] for member in self._get_cluster_status()["members"]])
 
     def _create_directory(self, path: str, mode: int) -> None:
         """Creates a directory.
@@ -132,16 +163,48 @@ class Patroni:
               directory using chmod (e.g. 0o640).
         """
         os.makedirs(path, mode=mode, exist_ok=True)
-        # Ensure correct permissions are set on the directory.
-        os.chmod(path, mode)
-        self._change_owner(path)
-
-    def _get_postgresql_version(self) -> str:
-        """Return the PostgreSQL version from the system."""
+        # Ensure correct permissions and ownership are set on the directory
+        # (changing them only when they differ, as the directory usually exists).
+        status = os.stat(path)
+        if stat.S_IMODE(status.st_mode) != mode:
+            os.chmod(path, mode)
+        if (status.st_uid, status.st_gid) != self._get_postgres_user_ids():
+            self._change_owner(path)
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _get_postgresql_version() -> str:
+        """Return the PostgreSQL version from the system.
+
+        The result is cached, as the installed package doesn't change while the charm runs.
+        """
         package = DebianPackage.from_system("postgresql")
         # Remove the Ubuntu revision from the version.
         return str(package.version).split("+")[0]
 
+    def _get_cluster_status(self, max_age: float = 1.0) -> Dict:
+        """Get the cluster status from Patroni, reusing a recently retrieved one.
+
+        Args:
+            max_age: number of seconds for which a retrieved status is reused.
+
+        Returns:
+            cluster status (with all members of the cluster and their states).
+        """
+        # The charm creates a new Patroni object every time it's used, so the
+        # statuses are kept at module level to be reused between those objects.
+        if self.unit_ip in _cluster_statuses:
+            retrieved_at, cluster_status = _cluster_statuses[self.unit_ip]
+            if time.monotonic() - retrieved_at < max_age:
+                return cluster_status
+
+        # Request info from cluster endpoint (which returns all members of the cluster).
+        cluster_status = _http_session.get(
+            f"http://{self.unit_ip}:8008/cluster", timeout=API_REQUEST_TIMEOUT
+        ).json()
+        _cluster_statuses[self.unit_ip] = (time.monotonic(), cluster_status)
+        return cluster_status
+
     def get_member_ip(self, member_name: str) -> str:
         """Get cluster member IP address.
 
@@ -152,9 +215,7 @@ class Patroni:
             IP address of the cluster member.
         """
         ip = None
-        # Request info from cluster endpoint (which returns all members of the cluster).
-        cluster_status = requests.get(f"http://{self.unit_ip}:8008/cluster")
-        for member in cluster_status.json()["members"]:
+        for member in self._get_cluster_status()["members"]:
             if member["name"] == member_name:
                 ip = member["host"]
                 break
@@ -170,9 +231,7 @@ class Patroni:
             primary pod or unit name.
         """
         primary = None
-        # Request info from cluster endpoint (which returns all members of the cluster).
-        cluster_status = requests.get(f"http://{self.unit_ip}:8008/cluster")
-        for member in cluster_status.json()["members"]:
+        for member in self._get_cluster_status()["members"]:
             if member["role"] == "leader":
                 primary = member["name"]
                 if unit_name_pattern:
@@ -185,24 +244,30 @@ class Patroni:
         """Check if all members are correctly running Patroni and PostgreSQL.
 
         Returns:
-            True if all members are ready False otherwise. Retries over a period of 10 seconds
-            3 times to allow server time to start up.
+            True if all members are ready False otherwise. Retries over a period of 10 seconds,
+            starting with short waits, to allow server time to start up.
         """
         # Request info from cluster endpoint
         # (which returns all members of the cluster and their states).
         try:
-            for attempt in Retrying(stop=stop_after_delay(10), wait=wait_fixed(3)):
+            for attempt in Retrying(
+                stop=stop_after_delay(10), wait=wait_exponential(multiplier=0.25, max=3)
+            ):
                 with attempt:
-                    cluster_status = requests.get(f"http://{self.unit_ip}:8008/cluster")
+                    members = self._get_cluster_status()["members"]
         except RetryError:
             return False
 
         # Check if all members are running and one of them is a leader (primary),
         # because sometimes there may exist (for some period of time) only
         # replicas after a failed switchover.
-        return all(
-            member["state"] == "running" for member in cluster_status.json()["members"]
-        ) and any(member["role"] == "leader" for member in cluster_status.json()["members"])
+        has_leader = False
+        for member in members:
+            if member["state"] != "running":
+                return False
+            if member["role"] == "leader":
+                has_leader = True
+        return has_leader
 
     @property
     def member_started(self) -> bool:
@@ -215,13 +280,15 @@ class Patroni:
         try:
             for attempt in Retrying(stop=stop_after_delay(60), wait=wait_fixed(3)):
                 with attempt:
-                    r = requests.get(f"http://{self.unit_ip}:8008/health")
+                    r = _http_session.get(
+                        f"http://{self.unit_ip}:8008/health", timeout=API_REQUEST_TIMEOUT
+                    )
         except RetryError:
             return False
 
         return r.json()["state"] == "running"
 
-    def _render_file(self, path: str, content: str, mode: int) -> None:
+    def _render_file(self, path: str, content: str, mode: int) -> bool:
         """Write a content rendered from a template to a file.
 
         Args:
@@ -229,30 +296,53 @@ class Patroni:
             content: the data to be written to the file.
             mode: access permission mask applied to the
               file using chmod (e.g. 0o640).
+
+        Returns:
+            whether the content of the file has changed.
         """
         # TODO: keep this method to use it also for generating replication configuration files and
         # move it to an utils / helpers file.
-        # Write the content to the file.
-        with open(path, "w+") as file:
+        # Leave the file untouched if it already has the content, only fixing
+        # its permissions and ownership when they differ (like in _create_directory).
+        try:
+            with open(path, "r") as file:
+                unchanged = file.read() == content
+        except FileNotFoundError:
+            unchanged = False
+        if unchanged:
+            status = os.stat(path)
+            if stat.S_IMODE(status.st_mode) != mode:
+                os.chmod(path, mode)
+            if (status.st_uid, status.st_gid) != self._get_postgres_user_ids():
+                self._change_owner(path)
+            return False
+        # Write the content to a temporary file and then replace the
+        # original file with it, so the file is never partially written.
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w+") as file:
             file.write(content)
         # Ensure correct permissions are set on the file.
-        os.chmod(path, mode)
-        self._change_owner(path)
+        os.chmod(temporary_path, mode)
+        self._change_owner(temporary_path)
+        os.replace(temporary_path, path)
+        return True
 
-    def _render_patroni_service_file(self) -> None:
-        """Render the Patroni configuration file."""
-        # Open the template patroni systemd unit file.
-        with open("templates/patroni.service.j2", "r") as file:
-            template = Template(file.read())
+    def _render_patroni_service_file(self) -> bool:
+        """Render the Patroni systemd service file.
+
+        Returns:
+            whether the content of the service file has changed.
+        """
+        # Get the template patroni systemd unit file.
+        template = TEMPLATE_ENVIRONMENT.get_template("patroni.service.j2")
         # Render the template file with the correct values.
         rendered = template.render(conf_path=self.storage_path)
-        self._render_file("/etc/systemd/system/patroni.service", rendered, 0o644)
+        return self._render_file("/etc/systemd/system/patroni.service", rendered, 0o644)
 
     def render_patroni_yml_file(self, replica: bool = False) -> None:
         """Render the Patroni configuration file."""
-        # Open the template patroni.yml file.
-        with open("templates/patroni.yml.j2", "r") as file:
-            template = Template(file.read())
+        # Get the template patroni.yml file.
+        template = TEMPLATE_ENVIRONMENT.get_template("patroni.yml.j2")
         # Render the template file with the correct values.
         rendered = template.render(
             conf_path=self.storage_path,
@@ -270,9 +360,8 @@ class Patroni:
 
     def render_postgresql_conf_file(self) -> None:
         """Render the PostgreSQL configuration file."""
-        # Open the template postgresql.conf file.
-        with open("templates/postgresql.conf.j2", "r") as file:
-            template = Template(file.read())
+        # Get the template postgresql.conf file.
+        template = TEMPLATE_ENVIRONMENT.get_template("postgresql.conf.j2")
         # Render the template file with the correct values.
         # TODO: add extra configurations here later.
         rendered = template.render(
@@ -298,15 +387,19 @@ class Patroni:
         for attempt in Retrying(stop=stop_after_delay(60), wait=wait_fixed(3)):
             with attempt:
                 current_primary = self.get_primary()
-                r = requests.post(
+                r = _http_session.post(
                     f"http://{self.unit_ip}:8008/switchover",
                     json={"leader": current_primary},
+                    timeout=API_REQUEST_TIMEOUT,
                 )
 
         # Check whether the switchover was unsuccessful.
         if r.status_code != 200:
             raise SwitchoverFailedError(f"received {r.status_code}")
 
+        # Discard the cached cluster status, as it still refers to the old primary.
+        _cluster_statuses.pop(self.unit_ip, None)
+
     @retry(
         retry=retry_if_result(lambda x: not x),
         stop=stop_after_attempt(10),
@@ -336,23 +429,48 @@ class Patroni:
             RaftMemberNotFoundError: if the member to be removed
                 is not part of the raft cluster.
         """
-        # Get the status of the raft cluster.
-        raft_status = subprocess.check_output(
-            ["syncobj_admin", "-conn", "127.0.0.1:2222", "-status"]
-        ).decode("UTF-8")
-
         # Check whether the member is still part of the raft cluster.
-        if not member_ip or member_ip not in raft_status:
+        if not member_ip or member_ip not in self._get_raft_status():
             return
 
         # Remove the member from the raft cluster.
-        result = subprocess.check_output(
-            ["syncobj_admin", "-conn", "127.0.0.1:2222", "-remove", f"{member_ip}:2222"]
-        ).decode("UTF-8")
+        result = subprocess.run(
+            ["syncobj_admin", "-conn", "127.0.0.1:2222", "-remove", f"{member_ip}:2222"],
+            capture_output=True,
+            check=True,
+            encoding="UTF-8",
+        ).stdout
         if "SUCCESS" not in result:
             raise RemoveRaftMemberFailedError()
 
+        # Discard the cached raft status, as it still lists the removed member.
+        _raft_statuses.pop(self.unit_ip, None)
+
+    def _get_raft_status(self, max_age: float = 0.5) -> str:
+        """Get the status of the raft cluster, reusing a recently retrieved one.
+
+        Args:
+            max_age: number of seconds for which a retrieved status is reused.
+
+        Returns:
+            raft cluster status (as output by syncobj_admin).
+        """
+        # Reuse the statuses retrieved by other Patroni objects (as in _get_cluster_status).
+        if self.unit_ip in _raft_statuses:
+            retrieved_at, raft_status = _raft_statuses[self.unit_ip]
+            if time.monotonic() - retrieved_at < max_age:
+                return raft_status
+
+        raft_status = subprocess.run(
+            ["syncobj_admin", "-conn", "127.0.0.1:2222", "-status"],
+            capture_output=True,
+            check=True,
+            encoding="UTF-8",
+        ).stdout
+        _raft_statuses[self.unit_ip] = (time.monotonic(), raft_status)
+        return raft_status
+
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     def reload_patroni_configuration(self):
         """Reload Patroni configuration after it was changed."""
-        requests.post(f"http://{self.unit_ip}:8008/reload")
+        _http_session.post(f"http://{self.unit_ip}:8008/reload", timeout=API_REQUEST_TIMEOUT)
@@ -4,9 +4,11 @@
 import pytest as pytest
 from pytest_operator.plugin import OpsTest
 
+from tests.integration.helpers import build_database_charm
+
 
 @pytest.fixture(scope="module")
 async def charm(ops_test: OpsTest):
     """Build the charm-under-test."""
-    # Build charm from local source folder.
-    yield await ops_test.build_charm(".")
+    # Build charm from local source folder (or use a prebuilt one).
+    yield await build_database_charm(ops_test)
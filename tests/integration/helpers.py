@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
+import asyncio
 import itertools
+import os
 import tempfile
 import zipfile
 from datetime import datetime
@@ -25,6 +27,26 @@ METADATA = yaml.safe_load(Path("./metadata.yaml").read_text())
 DATABASE_APP_NAME = METADATA["name"]
 
 
+async def attach_patroni_resource(ops_test: OpsTest, application_name: str) -> None:
+    """Attach the Patroni resource to an application.
+
+    The resource is uploaded through the model connection, instead of through
+    the juju CLI. The upload is blocking (attach_resource isn't a coroutine in
+    libjuju 2.9), so it runs in a thread to keep other uploads concurrent.
+
+    Args:
+        ops_test: The ops test framework instance
+        application_name: The name of the application
+    """
+    application = ops_test.model.applications[application_name]
+
+    def attach_resource() -> None:
+        with open("patroni.tar.gz", "rb") as resource_file:
+            application.attach_resource("patroni", "patroni.tar.gz", resource_file)
+
+    await asyncio.get_running_loop().run_in_executor(None, attach_resource)
+
+
 async def build_connection_string(
     ops_test: OpsTest,
     application_name: str,
@@ -61,6 +83,25 @@ async def build_connection_string(
         return data.get("master")
 
 
+async def build_database_charm(ops_test: OpsTest) -> Path:
+    """Build the charm-under-test, unless a prebuilt one is provided.
+
+    The path of a prebuilt charm can be set in the DATABASE_CHARM_PATH environment
+    variable, which avoids building the same charm once per test module (and doing
+    it concurrently when the modules run in parallel).
+
+    Args:
+        ops_test: The ops test framework instance
+
+    Returns:
+        the path of the charm
+    """
+    charm_path = os.environ.get("DATABASE_CHARM_PATH")
+    if charm_path:
+        return Path(charm_path).resolve()
+    return await ops_test.build_charm(".")
+
+
 async def check_database_users_existence(
     ops_test: OpsTest,
     users_that_should_exist: List[str],
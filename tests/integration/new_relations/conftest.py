@@ -3,8 +3,11 @@
 # See LICENSE file for licensing details.
 
 import pytest
+from psycopg2.pool import ThreadedConnectionPool
 from pytest_operator.plugin import OpsTest
 
+from tests.integration.helpers import build_database_charm
+
 
 @pytest.fixture(scope="module")
 async def application_charm(ops_test: OpsTest):
@@ -17,5 +20,21 @@ async def application_charm(ops_test: OpsTest):
 @pytest.fixture(scope="module")
 async def database_charm(ops_test: OpsTest):
     """Build the database charm."""
-    charm = await ops_test.build_charm(".")
+    charm = await build_database_charm(ops_test)
     return charm
+
+
+@pytest.fixture(scope="session")
+def pg_pool_factory():
+    """Get a connection pool for a connection string, shared by all the tests."""
+    pools = {}
+
+    def get_pool(connection_string: str) -> ThreadedConnectionPool:
+        if connection_string not in pools:
+            pools[connection_string] = ThreadedConnectionPool(1, 8, dsn=connection_string)
+        return pools[connection_string]
+
+    yield get_pool
+
+    for pool in pools.values():
+        pool.closeall()
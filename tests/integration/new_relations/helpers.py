@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
+import asyncio
 import json
-from typing import Optional
+from typing import List, Optional
 
 import yaml
+from psycopg2.extras import execute_values
 from pytest_operator.plugin import OpsTest
 from tenacity import RetryError, Retrying, stop_after_attempt, wait_exponential
 
@@ -35,24 +37,84 @@ async def build_connection_string(
     """
     # Get the connection data exposed to the application through the relation.
     database = f'{application_name.replace("-", "_")}_{relation_name.replace("-", "_")}'
-    username = await get_application_relation_data(
-        ops_test, application_name, relation_name, "username", relation_id, relation_alias
-    )
-    password = await get_application_relation_data(
-        ops_test, application_name, relation_name, "password", relation_id, relation_alias
-    )
-    endpoints = await get_application_relation_data(
-        ops_test,
-        application_name,
-        relation_name,
-        "read-only-endpoints" if read_only_endpoint else "endpoints",
-        relation_id,
-        relation_alias,
+    username, password, endpoints = await asyncio.gather(
+        get_application_relation_data(
+            ops_test, application_name, relation_name, "username", relation_id, relation_alias
+        ),
+        get_application_relation_data(
+            ops_test, application_name, relation_name, "password", relation_id, relation_alias
+        ),
+        get_application_relation_data(
+            ops_test,
+            application_name,
+            relation_name,
+            "read-only-endpoints" if read_only_endpoint else "endpoints",
+            relation_id,
+            relation_alias,
+        ),
     )
     host = endpoints.split(",")[0].split(":")[0]
 
-    # Build the complete connection string to connect to the database.
-    return f"dbname='{database}' user='{username}' host='{host}' password='{password}' connect_timeout=10"
+    # Build the complete connection string to connect to the database
+    # (with TCP keepalives, so connections to an unresponsive unit fail fast).
+    return (
+        f"dbname='{database}' user='{username}' host='{host}' password='{password}'"
+        " connect_timeout=10 keepalives=1 keepalives_idle=5 keepalives_interval=2"
+        " keepalives_count=2"
+    )
+
+
+# Connection strings already built, indexed by the arguments used to build them.
+_connection_strings = {}
+
+
+async def build_cached_connection_string(
+    ops_test: OpsTest, application_name: str, relation_name: str, **kwargs
+) -> str:
+    """Build a PostgreSQL connection string, reusing the one built before with the same arguments.
+
+    Call invalidate_connection_strings after any change that updates the relation
+    data (like scaling the database), so the connection string is built again.
+
+    Args:
+        ops_test: The ops test framework instance
+        application_name: The name of the application
+        relation_name: name of the relation to get connection data from
+        kwargs: other arguments accepted by build_connection_string
+
+    Returns:
+        a PostgreSQL connection string
+    """
+    key = (application_name, relation_name, tuple(sorted(kwargs.items())))
+    if key not in _connection_strings:
+        _connection_strings[key] = await build_connection_string(
+            ops_test, application_name, relation_name, **kwargs
+        )
+    return _connection_strings[key]
+
+
+def invalidate_connection_strings(application_name: str = None) -> None:
+    """Discard the connection strings built by build_cached_connection_string.
+
+    Args:
+        application_name: The name of the application whose connection
+            strings are discarded (defaults to all the applications)
+    """
+    for key in list(_connection_strings):
+        if application_name is None or key[0] == application_name:
+            del _connection_strings[key]
+
+
+def bulk_insert(cursor, rows: List[str]) -> None:
+    """Insert rows into the test table using as few round trips as possible.
+
+    Args:
+        cursor: psycopg2 cursor to the database
+        rows: data of each row to be inserted
+    """
+    execute_values(
+        cursor, "INSERT INTO test(data) VALUES %s;", [(row,) for row in rows], page_size=1000
+    )
 
 
 async def check_relation_data_existence(
@@ -3,18 +3,23 @@
 # See LICENSE file for licensing details.
 import asyncio
 import logging
-from pathlib import Path
 
 import psycopg2
 import pytest
-import yaml
+from async_timeout import timeout
 from pytest_operator.plugin import OpsTest
 
-from tests.integration.helpers import scale_application
+from tests.integration.helpers import (
+    attach_patroni_resource,
+    get_primary,
+    scale_application,
+)
 from tests.integration.new_relations.helpers import (
-    build_connection_string,
+    build_cached_connection_string,
+    bulk_insert,
     check_relation_data_existence,
     get_application_relation_data,
+    invalidate_connection_strings,
 )
 
 logger = logging.getLogger(__name__)
@@ -23,13 +28,13 @@ APPLICATION_APP_NAME = "application"
 DATABASE_APP_NAME = "database"
 ANOTHER_DATABASE_APP_NAME = "another-database"
 APP_NAMES = [APPLICATION_APP_NAME, DATABASE_APP_NAME, ANOTHER_DATABASE_APP_NAME]
-DATABASE_APP_METADATA = yaml.safe_load(Path("./metadata.yaml").read_text())
 FIRST_DATABASE_RELATION_NAME = "first-database"
 SECOND_DATABASE_RELATION_NAME = "second-database"
 MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME = "multiple-database-clusters"
 ALIASED_MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME = "aliased-multiple-database-clusters"
 
 
+@pytest.mark.smoke
 @pytest.mark.abort_on_fail
 async def test_deploy_charms(ops_test: OpsTest, application_charm, database_charm):
     """Deploy both charms (application and database) to use in the tests."""
@@ -59,12 +64,17 @@ async def test_deploy_charms(ops_test: OpsTest, application_charm, database_char
         )
 
         # Attach the Patroni resource to the databases.
-        await ops_test.juju("attach-resource", DATABASE_APP_NAME, "patroni=patroni.tar.gz")
-        await ops_test.juju("attach-resource", ANOTHER_DATABASE_APP_NAME, "patroni=patroni.tar.gz")
+        await asyncio.gather(
+            attach_patroni_resource(ops_test, DATABASE_APP_NAME),
+            attach_patroni_resource(ops_test, ANOTHER_DATABASE_APP_NAME),
+        )
 
-        await ops_test.model.wait_for_idle(apps=APP_NAMES, status="active", timeout=3000)
+        # Bound the whole wait from here (without a timeout on the wait itself).
+        async with timeout(3000):
+            await ops_test.model.wait_for_idle(apps=APP_NAMES, status="active", timeout=None)
 
 
+@pytest.mark.smoke
 async def test_no_read_only_endpoint_in_standalone_cluster(ops_test: OpsTest):
     """Test that there is no read-only endpoint in a standalone cluster."""
     async with ops_test.fast_forward():
@@ -91,11 +101,13 @@ async def test_no_read_only_endpoint_in_standalone_cluster(ops_test: OpsTest):
         )
 
 
+@pytest.mark.slow
 async def test_read_only_endpoint_in_scaled_up_cluster(ops_test: OpsTest):
     """Test that there is read-only endpoint in a scaled up cluster."""
     async with ops_test.fast_forward():
         # Scale up the database.
         await scale_application(ops_test, DATABASE_APP_NAME, 2)
+        invalidate_connection_strings()
 
         # Try to get the connection string of the database using the read-only endpoint.
         # It should be available again.
@@ -108,74 +120,108 @@ async def test_read_only_endpoint_in_scaled_up_cluster(ops_test: OpsTest):
         )
 
 
+@pytest.mark.smoke
 @pytest.mark.abort_on_fail
-async def test_database_relation_with_charm_libraries(ops_test: OpsTest):
+async def test_database_relation_with_charm_libraries(ops_test: OpsTest, pg_pool_factory):
     """Test basic functionality of database relation interface."""
     # Get the connection string to connect to the database using the read/write endpoint.
-    connection_string = await build_connection_string(
+    connection_string = await build_cached_connection_string(
         ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME
     )
 
     # Connect to the database using the read/write endpoint.
-    with psycopg2.connect(connection_string) as connection, connection.cursor() as cursor:
-        # Check that it's possible to write and read data from the database that
-        # was created for the application.
+    pool = pg_pool_factory(connection_string)
+    connection = pool.getconn()
+    try:
         connection.autocommit = True
-        cursor.execute("DROP TABLE IF EXISTS test;")
-        cursor.execute("CREATE TABLE test(data TEXT);")
-        cursor.execute("INSERT INTO test(data) VALUES('some data');")
-        cursor.execute("SELECT data FROM test;")
-        data = cursor.fetchone()
-        assert data[0] == "some data"
-
-        # Check the version that the application received is the same on the database server.
-        cursor.execute("SELECT version();")
-        data = cursor.fetchone()[0].split(" ")[1]
-
-        # Get the version of the database and compare with the information that
-        # was retrieved directly from the database.
-        version = await get_application_relation_data(
-            ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME, "version"
-        )
-        assert version == data
+        with connection.cursor() as cursor:
+            # Check that it's possible to write and read data from the database that
+            # was created for the application (the statements without results
+            # are sent together in a single round trip).
+            cursor.execute("DROP TABLE IF EXISTS test; CREATE TABLE test(data TEXT);")
+            bulk_insert(cursor, ["some data"])
+            cursor.execute("SELECT data FROM test;")
+            assert cursor.fetchall() == [("some data",)]
+
+            # Check the version that the application received is the same on the database server
+            # (which is sent when connecting, so it doesn't need to be queried).
+            # Since PostgreSQL 10, the version number has only two parts.
+            server_version = connection.server_version
+            if server_version >= 100000:
+                data = f"{server_version // 10000}.{server_version % 10000}"
+            else:
+                data = (
+                    f"{server_version // 10000}.{server_version // 100 % 100}"
+                    f".{server_version % 100}"
+                )
+
+            # Get the version of the database and compare with the information that
+            # was retrieved directly from the database.
+            version = await get_application_relation_data(
+                ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME, "version"
+            )
+            assert version == data
+
+            # Try to alter some data in a read-only transaction (on the same
+            # connection, restoring the setting before returning it to the pool).
+            cursor.execute("SET default_transaction_read_only = on;")
+            try:
+                with pytest.raises(psycopg2.errors.ReadOnlySqlTransaction):
+                    cursor.execute("DROP TABLE test;")
+            finally:
+                cursor.execute("RESET default_transaction_read_only;")
+    finally:
+        pool.putconn(connection)
+
 
+@pytest.mark.slow
+async def test_read_only_endpoint_with_charm_libraries(ops_test: OpsTest, pg_pool_factory):
+    """Test that the read-only endpoint of the database relation interface is read-only."""
     # Get the connection string to connect to the database using the read-only endpoint.
-    connection_string = await build_connection_string(
+    replica_connection_string = await build_cached_connection_string(
         ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME, read_only_endpoint=True
     )
 
     # Connect to the database using the read-only endpoint.
-    with psycopg2.connect(connection_string) as connection, connection.cursor() as cursor:
-        # Read some data.
-        cursor.execute("SELECT data FROM test;")
-        data = cursor.fetchone()
-        assert data[0] == "some data"
-
-        # Try to alter some data in a read-only transaction.
-        with pytest.raises(psycopg2.errors.ReadOnlySqlTransaction):
-            cursor.execute("DROP TABLE test;")
-
-
-async def test_user_with_extra_roles(ops_test: OpsTest):
+    pool = pg_pool_factory(replica_connection_string)
+    connection = pool.getconn()
+    try:
+        with connection.cursor() as cursor:
+            # Read some data.
+            cursor.execute("SELECT data FROM test;")
+            data = cursor.fetchone()
+            assert data[0] == "some data"
+
+            # Try to alter some data in a read-only transaction.
+            with pytest.raises(psycopg2.errors.ReadOnlySqlTransaction):
+                cursor.execute("DROP TABLE test;")
+    finally:
+        pool.putconn(connection)
+
+
+@pytest.mark.smoke
+async def test_user_with_extra_roles(ops_test: OpsTest, pg_pool_factory):
     """Test superuser actions and the request for more permissions."""
     # Get the connection string to connect to the database.
-    connection_string = await build_connection_string(
+    connection_string = await build_cached_connection_string(
         ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME
     )
 
     # Connect to the database.
-    connection = psycopg2.connect(connection_string)
-    connection.autocommit = True
-    cursor = connection.cursor()
-
-    # Test the user can create a database and another user.
-    cursor.execute("CREATE DATABASE another_database;")
-    cursor.execute("CREATE USER another_user WITH ENCRYPTED PASSWORD 'test-password';")
-
-    cursor.close()
-    connection.close()
+    pool = pg_pool_factory(connection_string)
+    connection = pool.getconn()
+    try:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            # Test the user can create a database and another user (CREATE DATABASE
+            # can't run in a multi-statement query, so they are sent separately).
+            cursor.execute("CREATE DATABASE another_database;")
+            cursor.execute("CREATE USER another_user WITH ENCRYPTED PASSWORD 'test-password';")
+    finally:
+        pool.putconn(connection)
 
 
+@pytest.mark.smoke
 async def test_two_applications_doesnt_share_the_same_relation_data(
     ops_test: OpsTest, application_charm
 ):
@@ -185,98 +231,73 @@ async def test_two_applications_doesnt_share_the_same_relation_data(
     all_app_names = [another_application_app_name]
     all_app_names.extend(APP_NAMES)
 
-    # Deploy another application.
+    # Deploy another application and relate it with the database right away
+    # (a single wait covers both the deployment and the exchange of connection data).
     await ops_test.model.deploy(
         application_charm,
         application_name=another_application_app_name,
     )
-    await ops_test.model.wait_for_idle(apps=all_app_names, status="active")
-
-    # Relate the new application with the database
-    # and wait for them exchanging some connection data.
     await ops_test.model.add_relation(
         f"{another_application_app_name}:{FIRST_DATABASE_RELATION_NAME}", DATABASE_APP_NAME
     )
     await ops_test.model.wait_for_idle(apps=all_app_names, status="active")
 
     # Assert the two application have different relation (connection) data.
-    application_connection_string = await build_connection_string(
-        ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME
-    )
-    another_application_connection_string = await build_connection_string(
-        ops_test, another_application_app_name, FIRST_DATABASE_RELATION_NAME
+    application_connection_string, another_application_connection_string = await asyncio.gather(
+        build_cached_connection_string(
+            ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME
+        ),
+        build_cached_connection_string(
+            ops_test, another_application_app_name, FIRST_DATABASE_RELATION_NAME
+        ),
     )
 
     assert application_connection_string != another_application_connection_string
 
 
+@pytest.mark.smoke
+@pytest.mark.parametrize(
+    "relation_name,selector",
+    [
+        (MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME, "id"),
+        (ALIASED_MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME, "alias"),
+    ],
+    ids=["by-id", "by-alias"],
+)
 async def test_an_application_can_connect_to_multiple_database_clusters(
-    ops_test: OpsTest, database_charm
+    ops_test: OpsTest, database_charm, relation_name, selector
 ):
     """Test that an application can connect to different clusters of the same database."""
     # Relate the application with both database clusters
     # and wait for them exchanging some connection data.
-    first_cluster_relation = await ops_test.model.add_relation(
-        f"{APPLICATION_APP_NAME}:{MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME}", DATABASE_APP_NAME
-    )
-    second_cluster_relation = await ops_test.model.add_relation(
-        f"{APPLICATION_APP_NAME}:{MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME}",
-        ANOTHER_DATABASE_APP_NAME,
-    )
-    await ops_test.model.wait_for_idle(apps=APP_NAMES, status="active")
-
-    # Retrieve the connection string to both database clusters using the relation aliases
-    # and assert they are different.
-    application_connection_string = await build_connection_string(
-        ops_test,
-        APPLICATION_APP_NAME,
-        MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME,
-        relation_id=first_cluster_relation.id,
-    )
-    another_application_connection_string = await build_connection_string(
-        ops_test,
-        APPLICATION_APP_NAME,
-        MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME,
-        relation_id=second_cluster_relation.id,
-    )
-    assert application_connection_string != another_application_connection_string
-
-
-async def test_an_application_can_connect_to_multiple_aliased_database_clusters(
-    ops_test: OpsTest, database_charm
-):
-    """Test that an application can connect to different clusters of the same database."""
-    # Relate the application with both database clusters
-    # and wait for them exchanging some connection data.
-    await asyncio.gather(
+    first_cluster_relation, second_cluster_relation = await asyncio.gather(
+        ops_test.model.add_relation(f"{APPLICATION_APP_NAME}:{relation_name}", DATABASE_APP_NAME),
         ops_test.model.add_relation(
-            f"{APPLICATION_APP_NAME}:{ALIASED_MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME}",
-            DATABASE_APP_NAME,
-        ),
-        ops_test.model.add_relation(
-            f"{APPLICATION_APP_NAME}:{ALIASED_MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME}",
-            ANOTHER_DATABASE_APP_NAME,
+            f"{APPLICATION_APP_NAME}:{relation_name}", ANOTHER_DATABASE_APP_NAME
         ),
     )
     await ops_test.model.wait_for_idle(apps=APP_NAMES, status="active")
 
-    # Retrieve the connection string to both database clusters using the relation aliases
-    # and assert they are different.
-    application_connection_string = await build_connection_string(
-        ops_test,
-        APPLICATION_APP_NAME,
-        ALIASED_MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME,
-        relation_alias="cluster1",
-    )
-    another_application_connection_string = await build_connection_string(
-        ops_test,
-        APPLICATION_APP_NAME,
-        ALIASED_MULTIPLE_DATABASE_CLUSTERS_RELATION_NAME,
-        relation_alias="cluster2",
+    # Retrieve the connection string to both database clusters using the relation ids
+    # or the relation aliases and assert they are different.
+    if selector == "id":
+        first_cluster_kwargs = {"relation_id": first_cluster_relation.id}
+        second_cluster_kwargs = {"relation_id": second_cluster_relation.id}
+    else:
+        first_cluster_kwargs = {"relation_alias": "cluster1"}
+        second_cluster_kwargs = {"relation_alias": "cluster2"}
+    application_connection_string, another_application_connection_string = await asyncio.gather(
+        build_cached_connection_string(
+            ops_test, APPLICATION_APP_NAME, relation_name, **first_cluster_kwargs
+        ),
+        build_cached_connection_string(
+            ops_test, APPLICATION_APP_NAME, relation_name, **second_cluster_kwargs
+        ),
     )
     assert application_connection_string != another_application_connection_string
 
 
+@pytest.mark.smoke
 async def test_an_application_can_request_multiple_databases(ops_test: OpsTest, application_charm):
     """Test that an application can request additional databases using the same interface."""
     # Relate the charms using another relation and wait for them exchanging some connection data.
@@ -286,60 +307,77 @@ async def test_an_application_can_request_multiple_databases(ops_test: OpsTest,
     await ops_test.model.wait_for_idle(apps=APP_NAMES, status="active")
 
     # Get the connection strings to connect to both databases.
-    first_database_connection_string = await build_connection_string(
-        ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME
-    )
-    second_database_connection_string = await build_connection_string(
-        ops_test, APPLICATION_APP_NAME, SECOND_DATABASE_RELATION_NAME
+    first_database_connection_string, second_database_connection_string = await asyncio.gather(
+        build_cached_connection_string(
+            ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME
+        ),
+        build_cached_connection_string(
+            ops_test, APPLICATION_APP_NAME, SECOND_DATABASE_RELATION_NAME
+        ),
     )
 
     # Assert the two application have different relation (connection) data.
     assert first_database_connection_string != second_database_connection_string
 
 
-async def test_relation_data_is_updated_correctly_when_scaling(ops_test: OpsTest):
+@pytest.mark.slow
+async def test_relation_data_is_updated_correctly_when_scaling(ops_test: OpsTest, pg_pool_factory):
     """Test that relation data, like connection data, is updated correctly when scaling."""
-    # Retrieve the list of current database unit names.
-    units_to_remove = [unit.name for unit in ops_test.model.applications[DATABASE_APP_NAME].units]
+    # Retrieve the current primary, which will be removed
+    # (so the primary endpoint needs to be updated).
+    primary = await get_primary(
+        ops_test, ops_test.model.applications[DATABASE_APP_NAME].units[0].name
+    )
 
     async with ops_test.fast_forward():
-        # Add two more units.
-        await ops_test.model.applications[DATABASE_APP_NAME].add_units(2)
-        await ops_test.model.wait_for_idle(
-            apps=[DATABASE_APP_NAME], status="active", timeout=1000, wait_for_exact_units=4
-        )
-
-        # Remove the original units.
-        await ops_test.model.applications[DATABASE_APP_NAME].destroy_units(*units_to_remove)
-        await ops_test.model.wait_for_idle(
-            apps=[DATABASE_APP_NAME], status="active", timeout=3000, wait_for_exact_units=2
-        )
+        # Bound the whole scaling under a single timeout.
+        async with timeout(4000):
+            # Add one more unit.
+            await ops_test.model.applications[DATABASE_APP_NAME].add_units(1)
+            await ops_test.model.wait_for_idle(
+                apps=[DATABASE_APP_NAME], status="active", timeout=None, wait_for_exact_units=3
+            )
+
+            # Remove the primary unit.
+            await ops_test.model.applications[DATABASE_APP_NAME].destroy_units(primary)
+            await ops_test.model.wait_for_idle(
+                apps=[DATABASE_APP_NAME], status="active", timeout=None, wait_for_exact_units=2
+            )
 
         # Get the updated connection data and assert it can be used
         # to write and read some data properly.
-        primary_connection_string = await build_connection_string(
-            ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME
-        )
-        replica_connection_string = await build_connection_string(
-            ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME, read_only_endpoint=True
+        invalidate_connection_strings()
+        primary_connection_string, replica_connection_string = await asyncio.gather(
+            build_cached_connection_string(
+                ops_test, APPLICATION_APP_NAME, FIRST_DATABASE_RELATION_NAME
+            ),
+            build_cached_connection_string(
+                ops_test,
+                APPLICATION_APP_NAME,
+                FIRST_DATABASE_RELATION_NAME,
+                read_only_endpoint=True,
+            ),
         )
 
         # Connect to the database using the primary connection string.
-        with psycopg2.connect(primary_connection_string) as connection:
+        pool = pg_pool_factory(primary_connection_string)
+        connection = pool.getconn()
+        try:
             connection.autocommit = True
             with connection.cursor() as cursor:
                 # Check that it's possible to write and read data from the database that
                 # was created for the application.
-                cursor.execute("DROP TABLE IF EXISTS test;")
-                cursor.execute("CREATE TABLE test(data TEXT);")
-                cursor.execute("INSERT INTO test(data) VALUES('some data');")
+                cursor.execute("DROP TABLE IF EXISTS test; CREATE TABLE test(data TEXT);")
+                bulk_insert(cursor, ["some data"])
                 cursor.execute("SELECT data FROM test;")
-                data = cursor.fetchone()
-                assert data[0] == "some data"
-        connection.close()
+                assert cursor.fetchall() == [("some data",)]
+        finally:
+            pool.putconn(connection)
 
         # Connect to the database using the replica endpoint.
-        with psycopg2.connect(replica_connection_string) as connection:
+        pool = pg_pool_factory(replica_connection_string)
+        connection = pool.getconn()
+        try:
             with connection.cursor() as cursor:
                 # Read some data.
                 cursor.execute("SELECT data FROM test;")
@@ -349,14 +387,19 @@ async def test_relation_data_is_updated_correctly_when_scaling(ops_test: OpsTest
                 # Try to alter some data in a read-only transaction.
                 with pytest.raises(psycopg2.errors.ReadOnlySqlTransaction):
                     cursor.execute("DROP TABLE test;")
-        connection.close()
+        finally:
+            pool.putconn(connection)
 
         # Remove the relation and test that its user was deleted
-        # (by checking that the connection string doesn't work anymore).
+        # (by checking that the connection string doesn't work anymore,
+        # connecting directly instead of through the pool).
         await ops_test.model.applications[DATABASE_APP_NAME].remove_relation(
             f"{DATABASE_APP_NAME}:database",
             f"{APPLICATION_APP_NAME}:{FIRST_DATABASE_RELATION_NAME}",
         )
-        await ops_test.model.wait_for_idle(apps=[DATABASE_APP_NAME], status="active", timeout=1000)
+        async with timeout(1000):
+            await ops_test.model.wait_for_idle(
+                apps=[DATABASE_APP_NAME], status="active", timeout=None
+            )
         with pytest.raises(psycopg2.OperationalError):
-            psycopg2.connect(primary_connection_string)
+            psycopg2.connect(primary_connection_string, connect_timeout=5)
@@ -14,6 +14,7 @@ from tenacity import Retrying, stop_after_attempt, wait_exponential
 from tests.helpers import STORAGE_PATH
 from tests.integration.helpers import (
     DATABASE_APP_NAME,
+    attach_patroni_resource,
     build_application_name,
     check_cluster_members,
     convert_records_to_dict,
@@ -48,7 +49,7 @@ async def test_deploy(ops_test: OpsTest, charm: str, series: str):
         charm, resources=resources, application_name=application_name, series=series, num_units=3
     )
     # Attach the resource to the controller.
-    await ops_test.juju("attach-resource", application_name, "patroni=patroni.tar.gz")
+    await attach_patroni_resource(ops_test, application_name)
 
     # Reducing the update status frequency to speed up the triggering of deferred events.
     await ops_test.model.set_config({"update-status-hook-interval": "10s"})
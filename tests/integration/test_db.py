@@ -10,6 +10,7 @@ from pytest_operator.plugin import OpsTest
 
 from tests.integration.helpers import (
     DATABASE_APP_NAME,
+    attach_patroni_resource,
     build_connection_string,
     check_database_users_existence,
     check_databases_creation,
@@ -35,7 +36,7 @@ async def test_mailman3_core_db(ops_test: OpsTest, charm: str) -> None:
             num_units=DATABASE_UNITS,
         )
         # Attach the resource to the controller.
-        await ops_test.juju("attach-resource", DATABASE_APP_NAME, "patroni=patroni.tar.gz")
+        await attach_patroni_resource(ops_test, DATABASE_APP_NAME)
 
         # Wait until the PostgreSQL charm is successfully deployed.
         await ops_test.model.wait_for_idle(
@@ -10,6 +10,7 @@ from pytest_operator.plugin import OpsTest
 
 from tests.integration.helpers import (
     DATABASE_APP_NAME,
+    attach_patroni_resource,
     check_database_users_existence,
     check_databases_creation,
     deploy_and_relate_bundle_with_postgresql,
@@ -38,7 +39,7 @@ async def test_landscape_scalable_bundle_db(ops_test: OpsTest, charm: str) -> No
         num_units=DATABASE_UNITS,
     )
     # Attach the resource to the controller.
-    await ops_test.juju("attach-resource", DATABASE_APP_NAME, "patroni=patroni.tar.gz")
+    await attach_patroni_resource(ops_test, DATABASE_APP_NAME)
 
     # Deploy and test the Landscape Scalable bundle (using this PostgreSQL charm).
     relation_id = await deploy_and_relate_bundle_with_postgresql(
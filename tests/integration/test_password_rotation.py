@@ -8,6 +8,8 @@ from pytest_operator.plugin import OpsTest
 
 from tests.helpers import METADATA
 from tests.integration.helpers import (
+    attach_patroni_resource,
+    build_database_charm,
     check_patroni,
     get_password,
     restart_patroni,
@@ -22,12 +24,12 @@ APP_NAME = METADATA["name"]
 @pytest.mark.skip_if_deployed
 async def test_deploy_active(ops_test: OpsTest):
     """Build the charm and deploy it."""
-    charm = await ops_test.build_charm(".")
+    charm = await build_database_charm(ops_test)
     async with ops_test.fast_forward():
         await ops_test.model.deploy(
             charm, resources={"patroni": "patroni.tar.gz"}, application_name=APP_NAME, num_units=3
         )
-        await ops_test.juju("attach-resource", APP_NAME, "patroni=patroni.tar.gz")
+        await attach_patroni_resource(ops_test, APP_NAME)
         await ops_test.model.wait_for_idle(apps=[APP_NAME], status="active", timeout=1000)
 
 
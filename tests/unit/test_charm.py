@@ -232,6 +232,19 @@ class TestCharm(unittest.TestCase):
         # Assert the status didn't change.
         self.assertEqual(self.harness.model.unit.status, initial_status)
 
+    @patch_network_get(private_address="1.1.1.1")
+    @patch.dict("cluster._cluster_statuses", clear=True)
+    @patch("requests.Session.get")
+    def test_primary_endpoint(self, _get):
+        _get.return_value.json.return_value = {
+            "members": [{"name": "postgresql-0", "host": "1.1.1.1", "role": "leader"}]
+        }
+
+        # Test that the cluster status is retrieved from Patroni only once, even
+        # though each access to the charm's Patroni object creates a new one.
+        self.assertEqual(self.charm.primary_endpoint, "1.1.1.1")
+        _get.assert_called_once_with("http://1.1.1.1:8008/cluster", timeout=5)
+
     def test_on_get_password(self):
         # Create a mock event and set passwords in peer relation data.
         mock_event = MagicMock(params={})
@@ -2,10 +2,11 @@
 # See LICENSE file for licensing details.
 
 import unittest
-from unittest.mock import mock_open, patch
+from unittest.mock import call, mock_open, patch
 
 from jinja2 import Template
 
+import cluster
 from cluster import Patroni
 from lib.charms.operator_libs_linux.v0.apt import DebianPackage, PackageState
 from tests.helpers import STORAGE_PATH
@@ -15,20 +16,79 @@ PATRONI_SERVICE = "patroni"
 
 class TestCharm(unittest.TestCase):
     def setUp(self):
+        # Clear the cached PostgreSQL version and postgres user ids between tests.
+        Patroni._get_postgresql_version.cache_clear()
+        Patroni._get_postgres_user_ids.cache_clear()
+        # Clear the cluster and raft statuses shared between Patroni objects.
+        cluster._cluster_statuses.clear()
+        cluster._raft_statuses.clear()
+
         # Setup a cluster.
-        self.peers_ips = peers_ips = ["2.2.2.2", "3.3.3.3"]
+        self.peers_ips = ["2.2.2.2", "3.3.3.3"]
+
+        self.patroni = self._new_patroni()
 
-        self.patroni = Patroni(
+    def _new_patroni(self) -> Patroni:
+        """Returns a new Patroni object for the same unit (like the charm does on each use)."""
+        return Patroni(
             "1.1.1.1",
             STORAGE_PATH,
             "postgresql",
             "postgresql-0",
             1,
-            peers_ips,
+            self.peers_ips,
             "fake-superuser-password",
             "fake-replication-password",
         )
 
+    @patch("cluster.daemon_reload")
+    @patch("charm.Patroni.render_postgresql_conf_file")
+    @patch("charm.Patroni._render_patroni_service_file")
+    @patch("charm.Patroni.render_patroni_yml_file")
+    @patch("charm.Patroni._change_owner")
+    def test_configure_patroni_on_unit(
+        self, _, __, _render_patroni_service_file, ___, _daemon_reload
+    ):
+        # Test that systemd is not reloaded when the service file hasn't changed.
+        _render_patroni_service_file.return_value = False
+        self.patroni.configure_patroni_on_unit()
+        _daemon_reload.assert_not_called()
+
+        # Test that systemd is reloaded when the service file has changed.
+        _render_patroni_service_file.return_value = True
+        self.patroni.configure_patroni_on_unit()
+        _daemon_reload.assert_called_once()
+
+    @patch("os.chmod")
+    @patch("os.chown")
+    @patch("pwd.getpwnam")
+    @patch("os.stat")
+    @patch("os.makedirs")
+    def test_create_directory(self, _makedirs, _stat, _pwnam, _chown, _chmod):
+        # Set the uid/gid return values for lookup of 'postgres' user.
+        _pwnam.return_value.pw_uid = 35
+        _pwnam.return_value.pw_gid = 35
+        path = f"{STORAGE_PATH}/conf.d"
+
+        # Test when the directory doesn't have the correct permissions and ownership.
+        _stat.return_value.st_mode = 0o40755
+        _stat.return_value.st_uid = 0
+        _stat.return_value.st_gid = 0
+        self.patroni._create_directory(path, 0o644)
+        _makedirs.assert_called_once_with(path, mode=0o644, exist_ok=True)
+        _chmod.assert_called_once_with(path, 0o644)
+        _chown.assert_called_once_with(path, uid=35, gid=35)
+
+        # Test when the directory already has the correct permissions and ownership.
+        _chmod.reset_mock()
+        _chown.reset_mock()
+        _stat.return_value.st_mode = 0o40644
+        _stat.return_value.st_uid = 35
+        _stat.return_value.st_gid = 35
+        self.patroni._create_directory(path, 0o644)
+        _chmod.assert_not_called()
+        _chown.assert_not_called()
+
     @patch("charms.operator_libs_linux.v0.apt.DebianPackage.from_system")
     def test_get_postgresql_version(self, _from_system):
         # Mock the package returned by from_system call.
@@ -39,11 +99,115 @@ class TestCharm(unittest.TestCase):
         _from_system.assert_called_once_with("postgresql")
         self.assertEqual(version, "12")
 
+    @patch("requests.Session.get")
+    def test_get_cluster_status(self, _get):
+        _get.return_value.json.return_value = {"members": [{"name": "postgresql-0"}]}
+
+        # Test that the status is retrieved from Patroni only once when it's recent
+        # (even when it's requested through another Patroni object).
+        status = self.patroni._get_cluster_status()
+        self.assertEqual(self._new_patroni()._get_cluster_status(), status)
+        _get.assert_called_once_with("http://1.1.1.1:8008/cluster", timeout=5)
+
+        # Test that an old status is retrieved again.
+        self.assertEqual(self._new_patroni()._get_cluster_status(max_age=0), status)
+        self.assertEqual(_get.call_count, 2)
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_switchover(self, _get, _post):
+        _get.return_value.json.return_value = {
+            "members": [{"name": "postgresql-0", "role": "leader"}]
+        }
+        _post.return_value.status_code = 200
+
+        # Test that the cached status is discarded after a switchover,
+        # so the new primary is retrieved from Patroni.
+        self.patroni.switchover()
+        _post.assert_called_once_with(
+            "http://1.1.1.1:8008/switchover", json={"leader": "postgresql-0"}, timeout=5
+        )
+        self._new_patroni().get_primary()
+        self.assertEqual(_get.call_count, 2)
+
+    @patch("charm.Patroni._get_cluster_status")
+    def test_are_all_members_ready(self, _get_cluster_status):
+        # Test when all members are running and one of them is the leader.
+        _get_cluster_status.return_value = {
+            "members": [
+                {"state": "running", "role": "leader"},
+                {"state": "running", "role": "replica"},
+            ]
+        }
+        self.assertTrue(self.patroni.are_all_members_ready())
+
+        # Test when a member is not running.
+        _get_cluster_status.return_value["members"][1]["state"] = "stopped"
+        self.assertFalse(self.patroni.are_all_members_ready())
+
+        # Test when there is no leader.
+        _get_cluster_status.return_value = {
+            "members": [
+                {"state": "running", "role": "replica"},
+                {"state": "running", "role": "replica"},
+            ]
+        }
+        self.assertFalse(self.patroni.are_all_members_ready())
+
+    @patch("requests.Session.get")
+    def test_are_all_members_ready_reuses_cluster_status(self, _get):
+        _get.return_value.json.return_value = {
+            "members": [{"name": "postgresql-0", "state": "running", "role": "leader"}]
+        }
+
+        # Test that the cluster status retrieved through another Patroni object
+        # (like when the charm gets the primary in the same hook) is reused.
+        self._new_patroni().get_primary()
+        self.assertTrue(self.patroni.are_all_members_ready())
+        _get.assert_called_once_with("http://1.1.1.1:8008/cluster", timeout=5)
+
+    @patch("cluster._http_session")
+    def test_reload_patroni_configuration(self, _http_session):
+        # Test that all the Patroni objects (created on each use by the charm)
+        # send their requests through the same session.
+        self.patroni.reload_patroni_configuration()
+        self._new_patroni().reload_patroni_configuration()
+        _http_session.post.assert_has_calls([call("http://1.1.1.1:8008/reload", timeout=5)] * 2)
+
+    @patch("subprocess.run")
+    def test_remove_raft_member(self, _run):
+        _run.return_value.stdout = "partner_node_status_server_2.2.2.2:2222: 2"
+
+        # Test that a member that is not part of the raft cluster is not removed
+        # (using a new Patroni object each time, like the charm does).
+        self.patroni.remove_raft_member("3.3.3.3")
+        self._new_patroni().remove_raft_member("4.4.4.4")
+        # The raft status is retrieved only once.
+        _run.assert_called_once()
+
+        # Test a successful removal (using the cached raft status).
+        _run.return_value.stdout = "SUCCESS"
+        self._new_patroni().remove_raft_member("2.2.2.2")
+        self.assertEqual(_run.call_count, 2)
+        _run.assert_called_with(
+            ["syncobj_admin", "-conn", "127.0.0.1:2222", "-remove", "2.2.2.2:2222"],
+            capture_output=True,
+            check=True,
+            encoding="UTF-8",
+        )
+
+        # Test that the raft status is retrieved again after a removal.
+        _run.return_value.stdout = "partner_node_status_server_3.3.3.3:2222: 2"
+        self._new_patroni().remove_raft_member("2.2.2.2")
+        self.assertEqual(_run.call_count, 3)
+
+    @patch("os.stat")
+    @patch("os.replace")
     @patch("os.chmod")
     @patch("os.chown")
     @patch("pwd.getpwnam")
     @patch("tempfile.NamedTemporaryFile")
-    def test_render_file(self, _temp_file, _pwnam, _chown, _chmod):
+    def test_render_file(self, _temp_file, _pwnam, _chown, _chmod, _replace, _stat):
         # Set a mocked temporary filename.
         filename = "/tmp/temporaryfilename"
         _temp_file.return_value.name = filename
@@ -55,16 +219,64 @@ class TestCharm(unittest.TestCase):
             _pwnam.return_value.pw_uid = 35
             _pwnam.return_value.pw_gid = 35
             # Call the method using a temporary configuration file.
-            self.patroni._render_file(filename, "rendered-content", 0o640)
+            changed = self.patroni._render_file(filename, "rendered-content", 0o640)
 
-        # Check the rendered file is opened with "w+" mode.
-        self.assertEqual(mock.call_args_list[0][0], (filename, "w+"))
+        # Check the content is written with "w+" mode to a file next to
+        # the rendered file after reading the current content.
+        self.assertTrue(changed)
+        self.assertEqual(mock.call_args_list[0][0], (filename, "r"))
+        self.assertEqual(mock.call_args_list[1][0], (f"{filename}.tmp", "w+"))
         # Ensure that the correct user is lookup up.
         _pwnam.assert_called_with("postgres")
         # Ensure the file is chmod'd correctly.
-        _chmod.assert_called_with(filename, 0o640)
+        _chmod.assert_called_with(f"{filename}.tmp", 0o640)
         # Ensure the file is chown'd correctly.
-        _chown.assert_called_with(filename, uid=35, gid=35)
+        _chown.assert_called_with(f"{filename}.tmp", uid=35, gid=35)
+        # Ensure the written file replaces the rendered file.
+        _replace.assert_called_once_with(f"{filename}.tmp", filename)
+
+        # Test that the file is not touched when the content, the permissions
+        # and the ownership haven't changed.
+        _chmod.reset_mock()
+        _chown.reset_mock()
+        _replace.reset_mock()
+        _stat.return_value.st_mode = 0o100640
+        _stat.return_value.st_uid = 35
+        _stat.return_value.st_gid = 35
+        mock = mock_open(read_data="rendered-content")
+        with patch("builtins.open", mock, create=True):
+            changed = self.patroni._render_file(filename, "rendered-content", 0o640)
+        self.assertFalse(changed)
+        self.assertEqual(len(mock.call_args_list), 1)
+        self.assertEqual(mock.call_args_list[0][0], (filename, "r"))
+        _stat.assert_called_once_with(filename)
+        _chmod.assert_not_called()
+        _chown.assert_not_called()
+        _replace.assert_not_called()
+
+        # Test that only the ownership is fixed when the content is
+        # the same but the file has a wrong owner.
+        _stat.return_value.st_uid = 0
+        _stat.return_value.st_gid = 0
+        with patch("builtins.open", mock, create=True):
+            changed = self.patroni._render_file(filename, "rendered-content", 0o640)
+        self.assertFalse(changed)
+        _chmod.assert_not_called()
+        _chown.assert_called_once_with(filename, uid=35, gid=35)
+        _replace.assert_not_called()
+
+        # Test that only the permissions are fixed when the content is
+        # the same but the file has a wrong mode.
+        _chown.reset_mock()
+        _stat.return_value.st_mode = 0o100644
+        _stat.return_value.st_uid = 35
+        _stat.return_value.st_gid = 35
+        with patch("builtins.open", mock, create=True):
+            changed = self.patroni._render_file(filename, "rendered-content", 0o640)
+        self.assertFalse(changed)
+        _chmod.assert_called_once_with(filename, 0o640)
+        _chown.assert_not_called()
+        _replace.assert_not_called()
 
     @patch("charm.Patroni._render_file")
     @patch("charm.Patroni._create_directory")
@@ -74,17 +286,9 @@ class TestCharm(unittest.TestCase):
             template = Template(file.read())
         expected_content = template.render(conf_path=STORAGE_PATH)
 
-        # Setup a mock for the `open` method, set returned data to patroni.service template.
-        with open("templates/patroni.service.j2", "r") as f:
-            mock = mock_open(read_data=f.read())
+        # Call the method.
+        self.patroni._render_patroni_service_file()
 
-        # Patch the `open` method with our mock.
-        with patch("builtins.open", mock, create=True):
-            # Call the method
-            self.patroni._render_patroni_service_file()
-
-        # Check the template is opened read-only in the call to open.
-        self.assertEqual(mock.call_args_list[0][0], ("templates/patroni.service.j2", "r"))
         # Ensure the correct rendered template is sent to _render_file method.
         _render_file.assert_called_once_with(
             "/etc/systemd/system/patroni.service",
@@ -116,17 +320,9 @@ class TestCharm(unittest.TestCase):
             version=self.patroni._get_postgresql_version(),
         )
 
-        # Setup a mock for the `open` method, set returned data to patroni.yml template.
-        with open("templates/patroni.yml.j2", "r") as f:
-            mock = mock_open(read_data=f.read())
-
-        # Patch the `open` method with our mock.
-        with patch("builtins.open", mock, create=True):
-            # Call the method.
-            self.patroni.render_patroni_yml_file()
+        # Call the method.
+        self.patroni.render_patroni_yml_file()
 
-        # Check the template is opened read-only in the call to open.
-        self.assertEqual(mock.call_args_list[0][0], ("templates/patroni.yml.j2", "r"))
         # Ensure the correct rendered template is sent to _render_file method.
         _render_file.assert_called_once_with(
             f"{STORAGE_PATH}/patroni.yml",
@@ -147,17 +343,9 @@ class TestCharm(unittest.TestCase):
             synchronous_standby_names="*",
         )
 
-        # Setup a mock for the `open` method, set returned data to postgresql.conf template.
-        with open("templates/postgresql.conf.j2", "r") as f:
-            mock = mock_open(read_data=f.read())
-
-        # Patch the `open` method with our mock.
-        with patch("builtins.open", mock, create=True):
-            # Call the method
-            self.patroni.render_postgresql_conf_file()
+        # Call the method.
+        self.patroni.render_postgresql_conf_file()
 
-        # Check the template is opened read-only in the call to open.
-        self.assertEqual(mock.call_args_list[0][0], ("templates/postgresql.conf.j2", "r"))
         # Ensure the correct rendered template is sent to _render_file method.
         _render_file.assert_called_once_with(
             f"{STORAGE_PATH}/conf.d/postgresql-operator.conf",
@@ -0,0 +1,226 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+from unittest.mock import MagicMock, call, patch
+
+import psycopg2
+from charms.postgresql_k8s.v0 import postgresql
+from charms.postgresql_k8s.v0.postgresql import (
+    PostgreSQL,
+    PostgreSQLCreateUserError,
+    PostgreSQLDeleteUserError,
+)
+from psycopg2 import sql
+
+
+class TestPostgreSQL(unittest.TestCase):
+    def setUp(self):
+        # Clear the connection pools and PostgreSQL versions shared between PostgreSQL objects.
+        postgresql._pools.clear()
+        postgresql._postgresql_versions.clear()
+
+    def _new_postgresql(self) -> PostgreSQL:
+        """Returns a new PostgreSQL object (like the charm does on each use)."""
+        return PostgreSQL("1.1.1.1", "operator", "fake-password", "postgres")
+
+    @staticmethod
+    def _get_cursor(_connect_to_database):
+        """Returns the cursor of the mocked connections."""
+        connection = _connect_to_database.return_value.__enter__.return_value
+        return connection.cursor.return_value.__enter__.return_value
+
+    @staticmethod
+    def _new_connection(closed: int = 0, alive: bool = True) -> MagicMock:
+        """Returns a mocked connection, which may be closed or terminated by the server."""
+        connection = MagicMock(closed=closed)
+        if not alive:
+            cursor = connection.cursor.return_value.__enter__.return_value
+            cursor.execute.side_effect = psycopg2.OperationalError
+        return connection
+
+    @patch("charms.postgresql_k8s.v0.postgresql.monotonic")
+    @patch("charms.postgresql_k8s.v0.postgresql.ThreadedConnectionPool")
+    def test_get_connection_pool(self, _pool, _monotonic):
+        _pool.side_effect = lambda **kwargs: MagicMock()
+        _monotonic.return_value = 0
+
+        # Test that the pool is reused for the same connection string (even through
+        # different objects) and a new one is created for another database.
+        pool = self._new_postgresql()._get_connection_pool("postgres")
+        self.assertIs(self._new_postgresql()._get_connection_pool("postgres"), pool)
+        _pool.assert_called_once_with(
+            minconn=1,
+            maxconn=8,
+            dsn="dbname='postgres' user='operator' host='1.1.1.1'"
+            " password='fake-password' connect_timeout=1",
+        )
+        other_pool = self._new_postgresql()._get_connection_pool("other-database")
+        self.assertIsNot(other_pool, pool)
+        self.assertEqual(_pool.call_count, 2)
+
+        # Test that the pool in use isn't closed even when it was idle for long.
+        _monotonic.return_value = postgresql.POOL_IDLE_TIMEOUT + 1
+        self.assertIs(self._new_postgresql()._get_connection_pool("postgres"), pool)
+        pool.closeall.assert_not_called()
+        # Test that the other pool, which was idle for long, is closed and discarded.
+        other_pool.closeall.assert_called_once()
+        self.assertEqual(len(postgresql._pools), 1)
+        self.assertIsNot(self._new_postgresql()._get_connection_pool("other-database"), other_pool)
+
+    @patch("charms.postgresql_k8s.v0.postgresql.PostgreSQL._get_connection_pool")
+    def test_connect_to_database(self, _get_connection_pool):
+        pool = _get_connection_pool.return_value
+        pool.maxconn = 8
+        closed_connection = self._new_connection(closed=1)
+        terminated_connection = self._new_connection(alive=False)
+        connection = self._new_connection()
+        pool.getconn.side_effect = [closed_connection, terminated_connection, connection]
+
+        # Test that the closed and terminated connections are discarded
+        # and the connection is returned to the pool after it's used.
+        with self._new_postgresql()._connect_to_database("test-database") as used_connection:
+            self.assertIs(used_connection, connection)
+            self.assertTrue(used_connection.autocommit)
+            pool.putconn.assert_has_calls(
+                [call(closed_connection, close=True), call(terminated_connection, close=True)]
+            )
+        _get_connection_pool.assert_called_once_with("test-database")
+        pool.putconn.assert_called_with(connection, close=False)
+
+        # Test that the connection is returned to the pool when the body raises
+        # (closing it if it was closed meanwhile).
+        pool.reset_mock()
+        pool.getconn.side_effect = None
+        pool.getconn.return_value = connection
+        with self.assertRaises(psycopg2.Error):
+            with self._new_postgresql()._connect_to_database():
+                connection.closed = 2
+                raise psycopg2.Error()
+        _get_connection_pool.assert_called_with("postgres")
+        pool.putconn.assert_called_once_with(connection, close=True)
+
+    @patch("charms.postgresql_k8s.v0.postgresql.PostgreSQL._get_connection_pool")
+    def test_connect_to_database_discards_at_most_all_connections(self, _get_connection_pool):
+        pool = _get_connection_pool.return_value
+        pool.maxconn = 2
+        connections = [self._new_connection(alive=False) for _ in range(3)]
+        pool.getconn.side_effect = connections
+
+        # Test that the connection opened after all the pooled ones were
+        # discarded is used without checking it again.
+        with self._new_postgresql()._connect_to_database() as used_connection:
+            self.assertIs(used_connection, connections[2])
+        self.assertEqual(pool.getconn.call_count, 3)
+
+    @patch("charms.postgresql_k8s.v0.postgresql.PostgreSQL._connect_to_database")
+    def test_get_postgresql_version(self, _connect_to_database):
+        cursor = self._get_cursor(_connect_to_database)
+        cursor.fetchone.return_value = ("PostgreSQL 12.12 (Ubuntu 12.12-0ubuntu0.20.04.1)",)
+
+        # Test that the version is queried only once, even through different objects.
+        self.assertEqual(self._new_postgresql().get_postgresql_version(), "12.12")
+        self.assertEqual(self._new_postgresql().get_postgresql_version(), "12.12")
+        cursor.execute.assert_called_once_with("SELECT version();")
+
+    @patch("charms.postgresql_k8s.v0.postgresql.PostgreSQL._connect_to_database")
+    def test_create_user(self, _connect_to_database):
+        cursor = self._get_cursor(_connect_to_database)
+
+        # Test that a new user is created with a single statement.
+        self._new_postgresql().create_user("test-user", "test-password")
+        cursor.execute.assert_called_once_with(
+            sql.SQL("CREATE ROLE {} WITH LOGIN ENCRYPTED PASSWORD %s;").format(
+                sql.Identifier("test-user")
+            ),
+            ("test-password",),
+        )
+
+        # Test that an existing user is updated instead.
+        cursor.reset_mock()
+        cursor.execute.side_effect = [psycopg2.errors.DuplicateObject(), None]
+        self._new_postgresql().create_user("test-user", "test-password", admin=True)
+        self.assertEqual(cursor.execute.call_count, 2)
+        cursor.execute.assert_called_with(
+            sql.SQL("ALTER ROLE {} WITH LOGIN SUPERUSER ENCRYPTED PASSWORD %s;").format(
+                sql.Identifier("test-user")
+            ),
+            ("test-password",),
+        )
+
+        # Test that other errors are raised as a create user error.
+        cursor.execute.side_effect = psycopg2.Error
+        with self.assertRaises(PostgreSQLCreateUserError):
+            self._new_postgresql().create_user("test-user", "test-password")
+
+    @patch("charms.postgresql_k8s.v0.postgresql.PostgreSQL._connect_to_database")
+    def test_delete_user(self, _connect_to_database):
+        cursor = self._get_cursor(_connect_to_database)
+        reassign_and_drop_owned = sql.SQL(
+            "REASSIGN OWNED BY {user} TO {owner}; DROP OWNED BY {user};"
+        ).format(user=sql.Identifier("test-user"), owner=sql.Identifier("operator"))
+        drop_role = sql.SQL("DROP ROLE {};").format(sql.Identifier("test-user"))
+
+        # Test that the objects in other databases are cleaned with one statement for
+        # each database and the default database is cleaned along with the user deletion.
+        cursor.fetchall.return_value = [("postgres",), ("test-database",), ("other-database",)]
+        self._new_postgresql().delete_user("test-user")
+        self.assertEqual(
+            _connect_to_database.call_args_list,
+            [call(), call("test-database"), call("other-database"), call()],
+        )
+        self.assertEqual(
+            cursor.execute.call_args_list[1:],
+            [
+                call(reassign_and_drop_owned),
+                call(reassign_and_drop_owned),
+                call(sql.SQL(" ").join([reassign_and_drop_owned, drop_role])),
+            ],
+        )
+
+        # Test that only the user is deleted when it has no objects in the default database.
+        _connect_to_database.reset_mock()
+        cursor.reset_mock()
+        cursor.fetchall.return_value = [("test-database",)]
+        self._new_postgresql().delete_user("test-user")
+        self.assertEqual(
+            cursor.execute.call_args_list[1:],
+            [call(reassign_and_drop_owned), call(sql.SQL(" ").join([drop_role]))],
+        )
+
+        # Test that errors are raised as a delete user error.
+        cursor.execute.side_effect = psycopg2.Error
+        with self.assertRaises(PostgreSQLDeleteUserError):
+            self._new_postgresql().delete_user("test-user")
+
+    @patch("charms.postgresql_k8s.v0.postgresql.PostgreSQL._connect_to_database")
+    def test_create_user_with_extra_user_roles(self, _connect_to_database):
+        cursor = self._get_cursor(_connect_to_database)
+
+        # Test that role options separated by commas or spaces are accepted
+        # (ignoring empty entries, like the one after a trailing comma).
+        for extra_user_roles in [
+            "createdb,CREATEROLE",
+            "CREATEDB, CREATEROLE,",
+            "CREATEDB CREATEROLE",
+        ]:
+            cursor.reset_mock()
+            self._new_postgresql().create_user(
+                "test-user", "test-password", extra_user_roles=extra_user_roles
+            )
+            cursor.execute.assert_called_once_with(
+                sql.SQL(
+                    "CREATE ROLE {} WITH LOGIN ENCRYPTED PASSWORD %s CREATEDB CREATEROLE;"
+                ).format(sql.Identifier("test-user")),
+                ("test-password",),
+            )
+
+        # Test that anything other than plain role options is rejected
+        # without running any statement.
+        for extra_user_roles in ["CREATEDB; DROP TABLE test", "VALID UNTIL '2030-01-01'"]:
+            cursor.reset_mock()
+            with self.assertRaises(PostgreSQLCreateUserError):
+                self._new_postgresql().create_user(
+                    "test-user", "test-password", extra_user_roles=extra_user_roles
+                )
+            cursor.execute.assert_not_called()